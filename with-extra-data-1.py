@@ -3,13 +3,29 @@ FastAPI app called 'Bookipedia' that serves information about books and their au
 "many-to-many" relationship *with* extra data. This solution uses SQLAlchemy Association Proxies
 """
 
-from sqlalchemy import create_engine, Column, Integer, String, ForeignKey
-from sqlalchemy.orm import declarative_base, relationship, joinedload
+import os
+from sqlalchemy import create_engine, event, Column, Integer, String, ForeignKey
+from sqlalchemy.orm import declarative_base, relationship, joinedload, selectinload, sessionmaker
 from sqlalchemy.ext.associationproxy import association_proxy
+from sqlalchemy.pool import StaticPool
 
 # Make the engine
-engine = create_engine("sqlite+pysqlite:///:memory:", future=True, echo=True,
-                       connect_args={"check_same_thread": False})
+engine = create_engine("sqlite+pysqlite:///:memory:", future=True, echo=os.getenv("SQL_ECHO") == "1",
+                       connect_args={"check_same_thread": False}, poolclass=StaticPool)
+
+# Tune SQLite on every new connection
+@event.listens_for(engine, "connect")
+def set_sqlite_pragma(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA cache_size=-64000")
+    cursor.execute("PRAGMA mmap_size=268435456")
+    cursor.close()
+
+# Make the session factory
+SessionLocal = sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
 
 # Make the DeclarativeMeta
 Base = declarative_base()
@@ -44,95 +60,138 @@ Base.metadata.create_all(engine)
 
 
 # Insert data
-from sqlalchemy.orm import Session
-with Session(bind=engine) as session:
-    book1 = Book(title="Dead People Who'd Be Influencers Today")
-    book2 = Book(title="How To Make Friends In Your 30s")
-
-    author1 = Author(name="Blu Renolds")
-    author2 = Author(name="Chip Egan")
-    author3 = Author(name="Alyssa Wyatt")
-
-    session.add_all([book1, book2, author1, author2, author3])
-    session.commit()
-
-    book_author1 = BookAuthor(book_id=book1.id, author_id=author1.id, blurb="Blue wrote chapter 1")
-    book_author2 = BookAuthor(book_id=book1.id, author_id=author2.id, blurb="Chip wrote chapter 2")
-    book_author3 = BookAuthor(book_id=book2.id, author_id=author1.id, blurb="Blue wrote chapters 1-3")
-    book_author4 = BookAuthor(book_id=book2.id, author_id=author3.id, blurb="Alyssa wrote chapter 4")
-
-    session.add_all([book_author1, book_author2, book_author3, book_author4])
+from sqlalchemy import insert
+with SessionLocal() as session:
+    session.execute(insert(Book), [
+        {"id": 1, "title": "Dead People Who'd Be Influencers Today"},
+        {"id": 2, "title": "How To Make Friends In Your 30s"},
+    ])
+    session.execute(insert(Author), [
+        {"id": 1, "name": "Blu Renolds"},
+        {"id": 2, "name": "Chip Egan"},
+        {"id": 3, "name": "Alyssa Wyatt"},
+    ])
+    session.execute(insert(BookAuthor), [
+        {"book_id": 1, "author_id": 1, "blurb": "Blue wrote chapter 1"},
+        {"book_id": 1, "author_id": 2, "blurb": "Chip wrote chapter 2"},
+        {"book_id": 2, "author_id": 1, "blurb": "Blue wrote chapters 1-3"},
+        {"book_id": 2, "author_id": 3, "blurb": "Alyssa wrote chapter 4"},
+    ])
     session.commit()
 
 
-from typing import List, Optional
-from pydantic import BaseModel, Field
-
-class AuthorBase(BaseModel):
-    id: int = Field(alias='author_id')
-    name: str = Field(alias='author_name')
-    blurb: Optional[str]
-
-    class Config:
-        orm_mode = True
-        allow_population_by_field_name = True
-
-class BookBase(BaseModel):
-    id: int = Field(alias='book_id')
-    title: str = Field(alias='book_title')
-    blurb: Optional[str]
-
-    class Config:
-        orm_mode = True
-        allow_population_by_field_name = True
-
-class BookSchema(BookBase):
-    authors: List[AuthorBase]
-
-class AuthorSchema(AuthorBase):
-    books: List[BookBase]
-
-
-from fastapi import FastAPI, Depends
-
-app = FastAPI(title="Bookipedia")
-
-def get_db():
-    db = Session(bind=engine)
-    try:
-        yield db
-    finally:
-        db.close()
-
-@app.get("/books/{id}", response_model=BookSchema,
-         response_model_exclude={'blurb'}, response_model_by_alias=False)
-async def get_book(id: int, db: Session = Depends(get_db)):
-    db_book = db.query(Book).options(joinedload(Book.authors)).\
-        where(Book.id == id).one()
-    return db_book
-
-
-@app.get("/books", response_model=List[BookSchema],
-         response_model_exclude={'blurb'}, response_model_by_alias=False)
-async def get_books(db: Session = Depends(get_db)):
-    db_books = db.query(Book).options(joinedload(Book.authors)).all()
-    return db_books
-
-
-@app.get("/authors/{id}", response_model=AuthorSchema,
-         response_model_exclude={'blurb'}, response_model_by_alias=False)
-async def get_author(id: int, db: Session = Depends(get_db)):
-    db_author = db.query(Author).options(joinedload(Author.books)).\
-        where(Author.id == id).one()
-    return db_author
-
-
-@app.get("/authors", response_model=List[AuthorSchema],
-         response_model_exclude={'blurb'}, response_model_by_alias=False)
-async def get_authors(db: Session = Depends(get_db)):
-    db_authors = db.query(Author).options(joinedload(Author.books)).all()
-    return db_authors
+def project_book(db_book):
+    return {
+        "id": db_book.id,
+        "title": db_book.title,
+        "authors": [
+            {"id": ba.author_id, "name": ba.author_name, "blurb": ba.blurb}
+            for ba in db_book.authors
+        ]
+    }
+
+def project_author(db_author):
+    return {
+        "id": db_author.id,
+        "name": db_author.name,
+        "books": [
+            {"id": ba.book_id, "title": ba.book_title, "blurb": ba.blurb}
+            for ba in db_author.books
+        ]
+    }
+
+
+import orjson
+from functools import lru_cache
+from fastapi import FastAPI, Response
+from fastapi.responses import ORJSONResponse, StreamingResponse
+
+app = FastAPI(title="Bookipedia", default_response_class=ORJSONResponse)
+
+def iter_json_array(chunks):
+    yield b"["
+    for i, chunk in enumerate(chunks):
+        if i:
+            yield b","
+        yield chunk
+    yield b"]"
+
+from sqlalchemy import bindparam, lambda_stmt, select
+
+# Build the queries once; lambda_stmt caches their construction and compiled SQL.
+# The cache is per module because uvicorn imports this file a second time, and
+# a shared cache would hand that copy the statements built for the first one.
+LAMBDA_CACHE = {}
+GET_BOOK = lambda_stmt(
+    lambda: select(Book).options(
+        joinedload(Book.authors).joinedload(BookAuthor.author)
+    ).where(Book.id == bindparam("id")),
+    lambda_cache=LAMBDA_CACHE
+)
+LIST_BOOKS = lambda_stmt(
+    lambda: select(Book).options(
+        selectinload(Book.authors).selectinload(BookAuthor.author)
+    ).execution_options(yield_per=256),
+    lambda_cache=LAMBDA_CACHE
+)
+GET_AUTHOR = lambda_stmt(
+    lambda: select(Author).options(
+        joinedload(Author.books).joinedload(BookAuthor.book)
+    ).where(Author.id == bindparam("id")),
+    lambda_cache=LAMBDA_CACHE
+)
+LIST_AUTHORS = lambda_stmt(
+    lambda: select(Author).options(
+        selectinload(Author.books).selectinload(BookAuthor.book)
+    ).execution_options(yield_per=256),
+    lambda_cache=LAMBDA_CACHE
+)
+
+# Encoded responses are cached per id; call .cache_clear() after writing to the database
+@lru_cache(maxsize=1024)
+def book_json(id):
+    with SessionLocal() as db:
+        db_book = db.execute(GET_BOOK, {"id": id}).unique().scalar_one()
+        return orjson.dumps(project_book(db_book))
+
+@lru_cache(maxsize=1024)
+def author_json(id):
+    with SessionLocal() as db:
+        db_author = db.execute(GET_AUTHOR, {"id": id}).unique().scalar_one()
+        return orjson.dumps(project_author(db_author))
+
+@app.get("/books/{id}")
+def get_book(id: int):
+    return Response(book_json(id), media_type="application/json")
+
+
+@app.get("/books")
+async def get_books():
+    def stream():
+        with SessionLocal() as db:
+            db_books = db.execute(LIST_BOOKS).scalars()
+            chunks = (orjson.dumps(project_book(b)) for b in db_books)
+            yield from iter_json_array(chunks)
+    return StreamingResponse(stream(), media_type="application/json")
+
+
+@app.get("/authors/{id}")
+def get_author(id: int):
+    return Response(author_json(id), media_type="application/json")
+
+
+@app.get("/authors")
+async def get_authors():
+    def stream():
+        with SessionLocal() as db:
+            db_authors = db.execute(LIST_AUTHORS).scalars()
+            chunks = (orjson.dumps(project_author(a)) for a in db_authors)
+            yield from iter_json_array(chunks)
+    return StreamingResponse(stream(), media_type="application/json")
 
 import uvicorn
+from pathlib import Path
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    # Each worker process imports this file and seeds its own in-memory database.
+    # uvicorn picks uvloop and httptools by itself when uvicorn[standard] is installed.
+    uvicorn.run(f"{Path(__file__).stem}:app", host="0.0.0.0", port=8000, workers=os.cpu_count())
\ No newline at end of file
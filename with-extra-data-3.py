@@ -1,14 +1,30 @@
 """
 FastAPI app called 'Bookipedia' that serves information about books and their authors. A simple example of a
-"many-to-many" relationship *with* extra data. This solution uses a custom pydantic GetterDict
+"many-to-many" relationship *with* extra data. This solution uses a custom pydantic model validator
 """
 
-from sqlalchemy import create_engine, Column, Integer, String, ForeignKey
-from sqlalchemy.orm import declarative_base, relationship, joinedload
+import os
+from sqlalchemy import create_engine, event, Column, Integer, String, ForeignKey
+from sqlalchemy.orm import declarative_base, relationship, joinedload, selectinload, sessionmaker
+from sqlalchemy.pool import StaticPool
 
 # Make the engine
-engine = create_engine("sqlite+pysqlite:///:memory:", future=True, echo=True,
-                       connect_args={"check_same_thread": False})
+engine = create_engine("sqlite+pysqlite:///:memory:", future=True, echo=os.getenv("SQL_ECHO") == "1",
+                       connect_args={"check_same_thread": False}, poolclass=StaticPool)
+
+# Tune SQLite on every new connection
+@event.listens_for(engine, "connect")
+def set_sqlite_pragma(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA cache_size=-64000")
+    cursor.execute("PRAGMA mmap_size=268435456")
+    cursor.close()
+
+# Make the session factory
+SessionLocal = sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
 
 # Make the DeclarativeMeta
 Base = declarative_base()
@@ -40,38 +56,28 @@ Base.metadata.create_all(engine)
 
 
 # Insert data
-from sqlalchemy.orm import Session
-with Session(bind=engine) as session:
-    book1 = Book(title="Dead People Who'd Be Influencers Today")
-    book2 = Book(title="How To Make Friends In Your 30s")
-
-    author1 = Author(name="Blu Renolds")
-    author2 = Author(name="Chip Egan")
-    author3 = Author(name="Alyssa Wyatt")
-
-    session.add_all([book1, book2, author1, author2, author3])
-    session.commit()
-
-    book_author1 = BookAuthor(book_id=book1.id, author_id=author1.id, blurb="Blue wrote chapter 1")
-    book_author2 = BookAuthor(book_id=book1.id, author_id=author2.id, blurb="Chip wrote chapter 2")
-    book_author3 = BookAuthor(book_id=book2.id, author_id=author1.id, blurb="Blue wrote chapters 1-3")
-    book_author4 = BookAuthor(book_id=book2.id, author_id=author3.id, blurb="Alyssa wrote chapter 4")
-
-    session.add_all([book_author1, book_author2, book_author3, book_author4])
+from sqlalchemy import insert
+with SessionLocal() as session:
+    session.execute(insert(Book), [
+        {"id": 1, "title": "Dead People Who'd Be Influencers Today"},
+        {"id": 2, "title": "How To Make Friends In Your 30s"},
+    ])
+    session.execute(insert(Author), [
+        {"id": 1, "name": "Blu Renolds"},
+        {"id": 2, "name": "Chip Egan"},
+        {"id": 3, "name": "Alyssa Wyatt"},
+    ])
+    session.execute(insert(BookAuthor), [
+        {"book_id": 1, "author_id": 1, "blurb": "Blue wrote chapter 1"},
+        {"book_id": 1, "author_id": 2, "blurb": "Chip wrote chapter 2"},
+        {"book_id": 2, "author_id": 1, "blurb": "Blue wrote chapters 1-3"},
+        {"book_id": 2, "author_id": 3, "blurb": "Alyssa wrote chapter 4"},
+    ])
     session.commit()
 
 
 from typing import List, Any
-from pydantic import BaseModel
-from pydantic.utils import GetterDict
-
-
-class BookAuthorGetter(GetterDict):
-    def get(self, key: str, default: Any = None) -> Any:
-        if key in {'id', 'name'}:
-            return getattr(self._obj.author, key)
-        else:
-            return super(BookAuthorGetter, self).get(key, default)
+from pydantic import BaseModel, ConfigDict, model_validator
 
 
 class BookAuthorSchema(BaseModel):
@@ -79,9 +85,14 @@ class BookAuthorSchema(BaseModel):
     name: str
     blurb: str
 
-    class Config:
-        orm_mode = True
-        getter_dict = BookAuthorGetter
+    model_config = ConfigDict(from_attributes=True)
+
+    @model_validator(mode="before")
+    @classmethod
+    def flatten_author(cls, data: Any) -> Any:
+        if isinstance(data, BookAuthor):
+            return {"id": data.author.id, "name": data.author.name, "blurb": data.blurb}
+        return data
 
 
 class BookSchema(BaseModel):
@@ -89,16 +100,7 @@ class BookSchema(BaseModel):
     title: str
     authors: List[BookAuthorSchema]
 
-    class Config:
-        orm_mode = True
-
-
-class AuthorBookGetter(GetterDict):
-    def get(self, key: str, default: Any = None) -> Any:
-        if key in {'id', 'title'}:
-            return getattr(self._obj.book, key)
-        else:
-            return super(AuthorBookGetter, self).get(key, default)
+    model_config = ConfigDict(from_attributes=True)
 
 
 class AuthorBookSchema(BaseModel):
@@ -106,9 +108,14 @@ class AuthorBookSchema(BaseModel):
     title: str
     blurb: str
 
-    class Config:
-        orm_mode = True
-        getter_dict = AuthorBookGetter
+    model_config = ConfigDict(from_attributes=True)
+
+    @model_validator(mode="before")
+    @classmethod
+    def flatten_book(cls, data: Any) -> Any:
+        if isinstance(data, BookAuthor):
+            return {"id": data.book.id, "title": data.book.title, "blurb": data.blurb}
+        return data
 
 
 class AuthorSchema(BaseModel):
@@ -116,61 +123,108 @@ class AuthorSchema(BaseModel):
     name: str
     books: List[AuthorBookSchema]
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
+
 
+from functools import lru_cache
+from fastapi import FastAPI, Response
+from fastapi.responses import ORJSONResponse, StreamingResponse
 
-from fastapi import FastAPI, Depends
+app = FastAPI(title="Bookipedia", default_response_class=ORJSONResponse)
 
-app = FastAPI(title="Bookipedia")
+def iter_json_array(chunks):
+    yield b"["
+    for i, chunk in enumerate(chunks):
+        if i:
+            yield b","
+        yield chunk
+    yield b"]"
 
-def get_db():
-    db = Session(bind=engine)
-    try:
-        yield db
-    finally:
-        db.close()
+from sqlalchemy import bindparam, lambda_stmt, select
 
-@app.get("/books/{id}", response_model=BookSchema)
-async def get_book(id: int, db: Session = Depends(get_db)):
-    db_book = db.query(Book).options(
+# Build the queries once; lambda_stmt caches their construction and compiled SQL.
+# The cache is per module because uvicorn imports this file a second time, and
+# a shared cache would hand that copy the statements built for the first one.
+LAMBDA_CACHE = {}
+GET_BOOK = lambda_stmt(
+    lambda: select(Book).options(
         joinedload(Book.authors).options(
-            joinedload(BookAuthor.author)
+            joinedload(BookAuthor.author).load_only(Author.id, Author.name)
+        )
+    ).where(Book.id == bindparam("id")),
+    lambda_cache=LAMBDA_CACHE
+)
+LIST_BOOKS = lambda_stmt(
+    lambda: select(Book).options(
+        selectinload(Book.authors).options(
+            selectinload(BookAuthor.author).load_only(Author.id, Author.name)
         )
-    ).where(Book.id == id).one()
-    return db_book
+    ).execution_options(yield_per=256),
+    lambda_cache=LAMBDA_CACHE
+)
+GET_AUTHOR = lambda_stmt(
+    lambda: select(Author).options(
+        joinedload(Author.books).options(
+            joinedload(BookAuthor.book).load_only(Book.id, Book.title)
+        )
+    ).where(Author.id == bindparam("id")),
+    lambda_cache=LAMBDA_CACHE
+)
+LIST_AUTHORS = lambda_stmt(
+    lambda: select(Author).options(
+        selectinload(Author.books).options(
+            selectinload(BookAuthor.book).load_only(Book.id, Book.title)
+        )
+    ).execution_options(yield_per=256),
+    lambda_cache=LAMBDA_CACHE
+)
 
+# Encoded responses are cached per id; call .cache_clear() after writing to the database
+@lru_cache(maxsize=1024)
+def book_json(id):
+    with SessionLocal() as db:
+        db_book = db.execute(GET_BOOK, {"id": id}).unique().scalar_one()
+        return BookSchema.model_validate(db_book).model_dump_json().encode()
 
-@app.get("/books", response_model=List[BookSchema])
-async def get_books(db: Session = Depends(get_db)):
-    db_books = db.query(Book).options(
-        joinedload(Book.authors).options(
-            joinedload(BookAuthor.author)
-        )
-    ).all()
-    return db_books
+@lru_cache(maxsize=1024)
+def author_json(id):
+    with SessionLocal() as db:
+        db_author = db.execute(GET_AUTHOR, {"id": id}).unique().scalar_one()
+        return AuthorSchema.model_validate(db_author).model_dump_json().encode()
 
+@app.get("/books/{id}")
+def get_book(id: int):
+    return Response(book_json(id), media_type="application/json")
 
-@app.get("/authors/{id}", response_model=AuthorSchema)
-async def get_author(id: int, db: Session = Depends(get_db)):
-    db_author = db.query(Author).options(
-        joinedload(Author.books).options(
-            joinedload(BookAuthor.book)
-        )
-    ).where(Author.id == id).one()
-    return db_author
 
+@app.get("/books")
+async def get_books():
+    def stream():
+        with SessionLocal() as db:
+            db_books = db.execute(LIST_BOOKS).scalars()
+            chunks = (BookSchema.model_validate(b).model_dump_json().encode() for b in db_books)
+            yield from iter_json_array(chunks)
+    return StreamingResponse(stream(), media_type="application/json")
 
-@app.get("/authors", response_model=List[AuthorSchema])
-async def get_authors(db: Session = Depends(get_db)):
-    db_authors = db.query(Author).options(
-        joinedload(Author.books).options(
-            joinedload(BookAuthor.book)
-        )
-    ).all()
-    return db_authors
+
+@app.get("/authors/{id}")
+def get_author(id: int):
+    return Response(author_json(id), media_type="application/json")
+
+
+@app.get("/authors")
+async def get_authors():
+    def stream():
+        with SessionLocal() as db:
+            db_authors = db.execute(LIST_AUTHORS).scalars()
+            chunks = (AuthorSchema.model_validate(a).model_dump_json().encode() for a in db_authors)
+            yield from iter_json_array(chunks)
+    return StreamingResponse(stream(), media_type="application/json")
 
 
 import uvicorn
+from pathlib import Path
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    # Each worker process imports this file and seeds its own in-memory database.
+    # uvicorn picks uvloop and httptools by itself when uvicorn[standard] is installed.
+    uvicorn.run(f"{Path(__file__).stem}:app", host="0.0.0.0", port=8000, workers=os.cpu_count())
\ No newline at end of file